@@ -1,22 +1,104 @@
 from __future__ import annotations
-import os, json, math
+import os, json, math, asyncio
+import numpy as np
 from typing import Optional, List, Dict, Any
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 
-from models.text import get_encoder, cosine_sim
+from models.text import get_encoder, cosine_sim, clean_text
 from models.analyzer import MisconceptionAnalyzer
 from models.difficulty import DifficultyEstimator
 
 ART_DIR = os.environ.get("ARTIFACT_DIR", os.path.join(os.path.dirname(__file__), "artifacts"))
 
-app = FastAPI(title="Misconception + IRT Backend", version="1.0.0")
+# orjson serializes the float-heavy nested payloads in C, well ahead of stdlib json
+app = FastAPI(title="Misconception + IRT Backend", version="1.0.0", default_response_class=ORJSONResponse)
 
 # ---- load components on startup ----
 encoder = get_encoder("sentence-transformers/all-MiniLM-L6-v2")
 mis_analyzer = MisconceptionAnalyzer(artifacts_dir=ART_DIR, encoder=encoder)
 diff_est = DifficultyEstimator(artifacts_dir=ART_DIR)
 
+# Warm up the encoder once at import so the first real request doesn't pay
+# tokenizer init (or torch.compile) latency.
+try:
+    encoder.encode(["warmup"] * 4, normalize_embeddings=True)
+except Exception:
+    pass
+
+# Cap concurrent encoder forward passes: handlers are async so the event loop
+# stays free, but CPU inference gains nothing from oversubscription.
+_ENCODE_SEM = asyncio.Semaphore(int(os.environ.get("MAX_CONCURRENT_ENCODES", "2")))
+
+
+class EmbedBatcher:
+    """Fuses embed requests from concurrent handlers into one encoder call.
+
+    Callers await embed_many(texts); a background worker drains the queue for
+    a short window (5 ms, up to `max_batch` texts), encodes everything in a
+    single batched call, and scatters each caller's slice back via its future.
+    One kernel dispatch instead of N, with padding amortized across requests.
+    """
+    def __init__(self, analyzer: MisconceptionAnalyzer, window_s: float = 0.005, max_batch: int = 32):
+        self.analyzer = analyzer
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def embed_many(self, texts: List[str]):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            # (re)arm the worker on the current loop; the loop changes across
+            # test clients but is stable under a running server
+            self.queue = asyncio.Queue()
+            self._loop = loop
+            self._task = loop.create_task(self._worker())
+        fut = loop.create_future()
+        await self.queue.put((texts, fut))
+        return await fut
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            n = len(batch[0][0])
+            deadline = loop.time() + self.window_s
+            while n < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                n += len(item[0])
+            flat = [t for texts, _ in batch for t in texts]
+            try:
+                async with _ENCODE_SEM:
+                    vecs = await asyncio.to_thread(self.analyzer.embed_many, flat)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            i = 0
+            for texts, fut in batch:
+                if not fut.done():
+                    fut.set_result(vecs[i:i + len(texts)])
+                i += len(texts)
+
+
+batcher = EmbedBatcher(mis_analyzer)
+
+
+async def _embed_texts(texts: List[str]):
+    """Embed through the micro-batcher so concurrent requests share one encode."""
+    return await batcher.embed_many(texts)
+
 @app.get("/health")
 def health():
     return {"ok": True, "artifacts": mis_analyzer.loaded, "difficulty_items": diff_est.n_items}
@@ -38,22 +120,22 @@ class EstimateDifficultyBody(BaseModel):
 
 # --------- Endpoints ---------
 @app.post("/api/predict_misconception")
-def predict_misconception(b: PredictMisconceptionBody):
+async def predict_misconception(b: PredictMisconceptionBody):
     try:
-        pred = mis_analyzer.predict_label(b.user_answer_text, qid=b.qid)
-        return pred
+        async with _ENCODE_SEM:
+            return await asyncio.to_thread(mis_analyzer.predict_label, b.user_answer_text, qid=b.qid)
     except Exception as e:
         raise HTTPException(500, detail=f"Misconception prediction failed: {e}")
 
 @app.post("/api/estimate_difficulty")
-def estimate_difficulty(b: EstimateDifficultyBody):
+async def estimate_difficulty(b: EstimateDifficultyBody):
     try:
-        return diff_est.estimate(question_text=b.question_text, qid=b.qid)
+        return await asyncio.to_thread(diff_est.estimate, question_text=b.question_text, qid=b.qid)
     except Exception as e:
         raise HTTPException(500, detail=f"Difficulty estimation failed: {e}")
 
 @app.post("/api/analyze/freeform")
-def analyze_freeform(b: AnalyzeBody):
+async def analyze_freeform(b: AnalyzeBody):
     """
     One-shot analysis:
     - similarity to ideal answer
@@ -64,66 +146,102 @@ def analyze_freeform(b: AnalyzeBody):
     - chart-ready payloads (pie + bars)
     """
     try:
-        # 1) similarities
-        sim_ui_vs_ideal = mis_analyzer.similarity(b.user_answer_text, b.ideal_answer_text)
-        sim_qi = mis_analyzer.similarity(b.question_text, b.ideal_answer_text)
-
-        # 2) misconception prediction
-        mis_pred = mis_analyzer.predict_label(b.user_answer_text, qid=b.qid)
-
-        # 3) question difficulty
-        diff = diff_est.estimate(question_text=b.question_text, qid=b.qid)
-
-        # 4) overall answer quality score (blend of similarity & misconception risk)
-        #    - high similarity, low mis-risk -> high score
-        mis_risk = 1.0 - mis_pred.get("confidence", 0.5) if mis_pred.get("label") in ("noise","misc") else mis_pred.get("risk", 0.4)
-        # normalize risk ∈ [0,1]
-        mis_risk = max(0.0, min(1.0, mis_risk))
-        answer_score = 0.65*sim_ui_vs_ideal + 0.35*(1.0 - mis_risk)
-        answer_score = float(round(answer_score, 3))
-
-        # 5) suggest “how to answer effectively”
-        guidance = mis_analyzer.suggest_guidance(
-            question=b.question_text,
-            ideal=b.ideal_answer_text,
-            user=b.user_answer_text,
-            mis_label=mis_pred.get("label", "noise")
-        )
-
-        # 6) chart-ready payloads
-        #    pie: proportions (match vs gap vs misconception)
-        pie = [
-            {"name": "Matches Ideal", "value": round(sim_ui_vs_ideal, 3)},
-            {"name": "Gaps vs Ideal", "value": round(max(0.0, 1.0 - sim_ui_vs_ideal - 0.15), 3)},  # leave room for mis
-            {"name": "Misconception Risk", "value": round(min(0.4, mis_risk), 3)}
-        ]
-
-        #    bars: similarity components
-        bars = [
-            {"metric": "User vs Ideal", "value": round(sim_ui_vs_ideal, 3)},
-            {"metric": "Question vs Ideal", "value": round(sim_qi, 3)},
-            {"metric": "Difficulty (0 easy–1 hard)", "value": round(diff["difficulty_norm"], 3)}
-        ]
-
-        # Final payload
-        return {
-            "question_text": b.question_text,
-            "ideal_answer_text": b.ideal_answer_text,
-            "user_answer_text": b.user_answer_text,
-
-            "similarity": {
-                "user_vs_ideal": round(sim_ui_vs_ideal, 3),
-                "question_vs_ideal": round(sim_qi, 3)
-            },
-            "misconception": mis_pred,
-            "difficulty": diff,
-            "answer_score": answer_score,
-            "guidance": guidance,
-
-            "charts": {
-                "pie": pie,
-                "bars": bars
-            }
-        }
+        # 0) sanitize each text exactly once at the boundary; everything
+        #    downstream works on the cleaned strings
+        q = clean_text(b.question_text)
+        ideal = clean_text(b.ideal_answer_text)
+        user = clean_text(b.user_answer_text)
+
+        # 1) encode question/ideal/user in one batched call, then reuse the
+        #    unit-norm vectors for every similarity and the classifier;
+        #    known qids reuse the ideal vector precomputed at startup
+        ideal_vec = mis_analyzer.get_ideal_vec(b.qid)
+        if ideal_vec is not None:
+            qu = await _embed_texts([q, user])
+            vecs = np.vstack([qu[0], ideal_vec, qu[1]])
+        else:
+            vecs = await _embed_texts([q, ideal, user])
+        # finish the remaining (mostly CPU-light) work off the event loop too
+        return await asyncio.to_thread(_finish_freeform, b, vecs, q, ideal, user)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, detail=f"Analysis failed: {e}")
+
+
+def _finish_freeform(b: AnalyzeBody, vecs, q: str, ideal: str, user: str) -> Dict[str, Any]:
+    """Synchronous tail of analyze_freeform, run in a worker thread.
+    q/ideal/user are the already-cleaned texts from the endpoint boundary."""
+    # one 3x3 Gram matrix gives every pairwise similarity in a single BLAS
+    # call; rows are (question, ideal, user)
+    S = vecs @ vecs.T
+    sim_ui_vs_ideal = float(round(float(S[2, 1]), 4))
+    sim_qi = float(round(float(S[0, 1]), 4))
+
+    # 2) misconception prediction (reuses the user-answer vector)
+    mis_pred = mis_analyzer.predict_label_from_vec(vecs[2], qid=b.qid)
+
+    # 3) question difficulty
+    diff = diff_est.estimate(question_text=b.question_text, qid=b.qid)
+
+    # 4) overall answer quality score (blend of similarity & misconception risk)
+    #    - high similarity, low mis-risk -> high score
+    mis_risk = 1.0 - mis_pred.get("confidence", 0.5) if mis_pred.get("label") in ("noise","misc") else mis_pred.get("risk", 0.4)
+    # normalize risk ∈ [0,1]
+    mis_risk = max(0.0, min(1.0, mis_risk))
+    answer_score = 0.65*sim_ui_vs_ideal + 0.35*(1.0 - mis_risk)
+
+    # round every float headed for the payload in one C-level pass
+    r_sim_ui, r_sim_qi, r_diff, r_gap, r_mis, answer_score = np.round(np.array([
+        sim_ui_vs_ideal,
+        sim_qi,
+        diff["difficulty_norm"],
+        max(0.0, 1.0 - sim_ui_vs_ideal - 0.15),  # leave room for mis
+        min(0.4, mis_risk),
+        answer_score,
+    ], dtype=np.float64), 3).tolist()
+
+    # 5) suggest “how to answer effectively”
+    guidance = mis_analyzer.suggest_guidance(
+        question=q,
+        ideal=ideal,
+        user=user,
+        mis_label=mis_pred.get("label", "noise"),
+        sim_ui=sim_ui_vs_ideal
+    )
+
+    # 6) chart-ready payloads
+    #    pie: proportions (match vs gap vs misconception)
+    pie = [
+        {"name": "Matches Ideal", "value": r_sim_ui},
+        {"name": "Gaps vs Ideal", "value": r_gap},
+        {"name": "Misconception Risk", "value": r_mis}
+    ]
+
+    #    bars: similarity components
+    bars = [
+        {"metric": "User vs Ideal", "value": r_sim_ui},
+        {"metric": "Question vs Ideal", "value": r_sim_qi},
+        {"metric": "Difficulty (0 easy–1 hard)", "value": r_diff}
+    ]
+
+    # Final payload
+    return {
+        "question_text": b.question_text,
+        "ideal_answer_text": b.ideal_answer_text,
+        "user_answer_text": b.user_answer_text,
+
+        "similarity": {
+            "user_vs_ideal": r_sim_ui,
+            "question_vs_ideal": r_sim_qi
+        },
+        "misconception": mis_pred,
+        "difficulty": diff,
+        "answer_score": answer_score,
+        "guidance": guidance,
+
+        "charts": {
+            "pie": pie,
+            "bars": bars
+        }
+    }
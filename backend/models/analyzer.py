@@ -1,44 +1,106 @@
 # models/analyzer.py
 from __future__ import annotations
-import os, json
+import os, json, re
 import numpy as np
 import pandas as pd
 import joblib
 from typing import Optional, Dict, Any
-from .text import embed, cosine_sim, clean_text, get_encoder
+from .text import embed, embed_cached, cosine_sim, clean_text, get_encoder
+
+# precompiled keyword scans (one C-level search per call instead of a Python
+# loop of substring checks)
+_MIS_RX = re.compile(r"miscon|error|wrong|confuse|noise")
+_GUIDANCE_RX = re.compile(r"epsilon|ε|dfa|nfa|regex|star|union|concat|equiv")
 
 class MisconceptionAnalyzer:
     def __init__(self, artifacts_dir: str, encoder):
         self.encoder = encoder
         self.loaded = False
-        self.label_ref = {}   # (optional) known cluster labels per qid
+        # known cluster labels, stored as one flat array sorted within each
+        # qid block plus (start, end) slices -- membership checks bisect the
+        # block instead of scanning a Python list
+        self.labels_flat = np.empty(0, dtype=object)
+        self.qid_offsets = {}   # qid -> (start, end) into labels_flat
         self.clf = None
+        self.ideal_vecs = None   # (optional) precomputed ideal-answer embeddings, N x D
+        self.qid_to_row = {}     # qid -> row in ideal_vecs
         self._load(artifacts_dir)
 
     def _load(self, art: str):
         # classifier
         clf_path = os.path.join(art, "misconception_clf.joblib")
         if os.path.exists(clf_path):
-            self.clf = joblib.load(clf_path)
+            # mmap large arrays read-only so forked uvicorn workers share
+            # pages instead of each deserializing its own copy
+            self.clf = joblib.load(clf_path, mmap_mode="r")
         # labels
         lbl_path = os.path.join(art, "cluster_labels.parquet")
         if os.path.exists(lbl_path):
             df = pd.read_parquet(lbl_path)
-            # build list of labels per qid
-            for qid, grp in df.groupby("qid"):
-                self.label_ref[int(qid)] = sorted(set(str(x) for x in grp["label"].tolist()))
+            # flat sorted array + per-qid slices
+            df = (df.assign(qid=df["qid"].astype(int), label=df["label"].astype(str))
+                    .drop_duplicates(["qid", "label"])
+                    .sort_values(["qid", "label"]))
+            self.labels_flat = df["label"].to_numpy()
+            # per-qid slice bounds in one vectorized pass (df is sorted by qid)
+            qids, counts = np.unique(df["qid"].to_numpy(), return_counts=True)
+            ends = np.cumsum(counts)
+            starts = ends - counts
+            self.qid_offsets = dict(zip(qids.tolist(), zip(starts.tolist(), ends.tolist())))
+        # ideal answers (optional): embed them all once at startup so the hot
+        # path can reuse the vectors instead of re-encoding per request
+        ideal_path = os.path.join(art, "ideal_answers.parquet")
+        if os.path.exists(ideal_path):
+            try:
+                idf = pd.read_parquet(ideal_path)
+                texts = [clean_text(str(t)) for t in idf["ideal_text"].tolist()]
+                self.ideal_vecs = embed(texts, self.encoder)
+                self.qid_to_row = {int(q): i for i, q in enumerate(idf["qid"].tolist())}
+            except Exception:
+                self.ideal_vecs = None
+                self.qid_to_row = {}
         self.loaded = True
 
+    def get_ideal_vec(self, qid: Optional[int]) -> Optional[np.ndarray]:
+        """Precomputed unit-norm embedding of the ideal answer for qid, if known."""
+        if qid is None or self.ideal_vecs is None:
+            return None
+        row = self.qid_to_row.get(int(qid))
+        return None if row is None else self.ideal_vecs[row]
+
     def similarity(self, a_text: str, b_text: str) -> float:
-        a_vec, b_vec = embed([clean_text(a_text), clean_text(b_text)], self.encoder)
+        a_vec, b_vec = embed_cached([clean_text(a_text), clean_text(b_text)], self.encoder)
         return float(round(cosine_sim(a_vec, b_vec), 4))
 
+    def embed_many(self, texts: list[str]) -> np.ndarray:
+        """
+        Encode several (already-cleaned) texts in one batched call.
+        Returns an (N, D) float32 array of unit-norm vectors, so callers can
+        take dot products directly instead of re-encoding pairs.
+        """
+        return embed_cached(texts, self.encoder)
+
     def predict_label(self, user_answer: str, qid: Optional[int] = None) -> Dict[str, Any]:
         text = clean_text(user_answer)
-        vec = embed([text], self.encoder)[0]
+        vec = embed_cached([text], self.encoder)[0]
+        return self.predict_label_from_vec(vec, qid=qid)
+
+    def predict_label_from_vec(self, vec: np.ndarray, qid: Optional[int] = None) -> Dict[str, Any]:
+        """Same as predict_label but takes a precomputed embedding (skips re-encoding)."""
+        return self.predict_label_batch(vec[None, :], [qid])[0]
+
+    def predict_label_batch(self, vecs: np.ndarray, qids: list[Optional[int]]) -> list[Dict[str, Any]]:
+        """Classify N precomputed embeddings with one predict_proba call.
+
+        One BLAS dispatch covers all rows; the per-row risk/OOD heuristics
+        stay in a cheap Python loop over the results.
+        """
         if self.clf is None:
             # fallback: no classifier available -> label “unknown” with mid confidence
-            return {"label": "unknown", "confidence": 0.5, "risk": 0.4, "explanation": "No classifier artifact found."}
+            return [{"label": "unknown", "confidence": 0.5, "risk": 0.4,
+                     "explanation": "No classifier artifact found."} for _ in qids]
+
+        buf = np.ascontiguousarray(np.asarray(vecs, dtype=np.float32))
 
         # predict_proba if available
         try:
@@ -52,60 +114,68 @@ class MisconceptionAnalyzer:
                 except Exception:
                     expected_dim = None
 
-            if expected_dim is not None and len(vec) != expected_dim:
-                # adapt vec to expected_dim using sensible strategies
-                v = vec.astype(float)
-                L = len(v)
+            if expected_dim is not None and buf.shape[1] != expected_dim:
+                # adapt rows to expected_dim using sensible strategies
+                L = buf.shape[1]
                 D = expected_dim
                 if D % L == 0:
                     # tile repeat
-                    v = np.tile(v, D // L)
+                    buf = np.tile(buf, (1, D // L))
                 elif D > L:
                     # pad with zeros
-                    pad = np.zeros(D - L, dtype=v.dtype)
-                    v = np.concatenate([v, pad])
+                    buf = np.concatenate([buf, np.zeros((buf.shape[0], D - L), dtype=buf.dtype)], axis=1)
                 else:
                     # truncate
-                    v = v[:D]
-                vec_for_pred = v
-            else:
-                vec_for_pred = vec
-
-            proba = self.clf.predict_proba([vec_for_pred])[0]
-            idx = int(np.argmax(proba))
-            label = self.clf.classes_[idx]
-            conf = float(proba[idx])
+                    buf = buf[:, :D]
+
+            proba = self.clf.predict_proba(buf)
+            idxs = np.argmax(proba, axis=1)
+            labels = [str(self.clf.classes_[i]) for i in idxs]
+            confs = [float(proba[r, i]) for r, i in enumerate(idxs)]
         except Exception:
             try:
-                label = str(self.clf.predict([vec])[0])
-                conf = 0.6
+                labels = [str(x) for x in self.clf.predict(buf)]
+                confs = [0.6] * len(labels)
             except Exception:
                 # if classifier fails unexpectedly, fallback to unknown
-                return {"label": "unknown", "confidence": 0.5, "risk": 0.4, "explanation": "Classifier prediction failed."}
+                return [{"label": "unknown", "confidence": 0.5, "risk": 0.4,
+                         "explanation": "Classifier prediction failed."} for _ in qids]
 
-        # heuristic “risk”: high if label seems misconception-like
-        risk = 0.2
-        if any(k in label.lower() for k in ["miscon", "error", "wrong", "confuse", "noise"]):
-            risk = max(0.4, 1.0 - conf + 0.4)
+        out = []
+        for label, conf, qid in zip(labels, confs, qids):
+            # heuristic “risk”: high if label seems misconception-like
+            risk = 0.2
+            if _MIS_RX.search(label.lower()):
+                risk = max(0.4, 1.0 - conf + 0.4)
 
-        # if we know valid labels for this qid, flag OOD
-        if qid is not None and qid in self.label_ref and label not in self.label_ref[qid]:
-            label = f"{label} (unseen@qid)"
-            risk = max(risk, 0.5)
+            # if we know valid labels for this qid, flag OOD (bisect into the
+            # sorted per-qid block)
+            if qid is not None:
+                s, e = self.qid_offsets.get(qid, (0, 0))
+                if e > s:
+                    i = s + int(np.searchsorted(self.labels_flat[s:e], label))
+                    if i == e or self.labels_flat[i] != label:
+                        label = f"{label} (unseen@qid)"
+                        risk = max(risk, 0.5)
 
-        return {"label": label, "confidence": round(conf, 3), "risk": round(float(risk), 3)}
+            out.append({"label": label, "confidence": round(conf, 3), "risk": round(float(risk), 3)})
+        return out
 
-    def suggest_guidance(self, question: str, ideal: str, user: str, mis_label: str) -> str:
+    def suggest_guidance(self, question: str, ideal: str, user: str, mis_label: str,
+                         sim_ui: Optional[float] = None) -> str:
         """
         Concise, deterministic guidance string (no external LLM).
+        Pass sim_ui when the user-vs-ideal similarity is already computed to
+        avoid re-encoding both texts.
         """
-        sim_ui = self.similarity(user, ideal)
+        if sim_ui is None:
+            sim_ui = self.similarity(user, ideal)
         tips = []
         # core elements
         tips.append(f"Start by restating the key term from the question in one line.")
         if sim_ui < 0.65:
             tips.append("Add a precise definition and one verifying example.")
-        if any(k in mis_label.lower() for k in ["epsilon","ε","dfa","nfa","regex","star","union","concat","equiv"]):
+        if _GUIDANCE_RX.search(mis_label.lower()):
             tips.append("Address the specific confusion noted in the label; contrast the two concepts explicitly.")
         tips.append("Finish with a short check: why your answer satisfies the definition or rule.")
         return " ".join(tips)
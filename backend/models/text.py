@@ -1,6 +1,8 @@
 from __future__ import annotations
+import os
 import re
 import hashlib
+import collections
 import numpy as np
 from typing import List, Any
 
@@ -10,6 +12,64 @@ try:
 except Exception:
     SentenceTransformer = None  # type: ignore
 
+# Pin Torch's thread pools up front: per-process intra-op threads default to
+# all cores, which thrashes caches once several uvicorn workers share a box.
+try:
+    import torch  # type: ignore
+    torch.set_num_threads(int(os.environ.get("TORCH_THREADS", "2")))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already initialized (e.g. on reload)
+except Exception:
+    torch = None  # type: ignore
+
+
+class OnnxEncoder:
+    """MiniLM served through ONNX Runtime with dynamic INT8 quantization.
+
+    INT8 matmuls roughly quadruple encode throughput over FP32 on CPUs with
+    VNNI, with negligible cosine-similarity drift. Exposes the same
+    ``encode(texts, normalize_embeddings=True)`` surface as
+    SentenceTransformer so callers don't change.
+    """
+    def __init__(self, model_name: str, cache_dir: str):
+        from transformers import AutoTokenizer  # type: ignore
+        import onnxruntime as ort  # type: ignore
+
+        quant_path = os.path.join(cache_dir, "model_quantized.onnx")
+        if not os.path.exists(quant_path):
+            self._export_and_quantize(model_name, cache_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.session = ort.InferenceSession(quant_path, providers=["CPUExecutionProvider"])
+
+    @staticmethod
+    def _export_and_quantize(model_name: str, cache_dir: str) -> None:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer  # type: ignore
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig  # type: ignore
+
+        model = ORTModelForFeatureExtraction.from_pretrained(
+            model_name, export=True, provider="CPUExecutionProvider"
+        )
+        model.save_pretrained(cache_dir)
+        quantizer = ORTQuantizer.from_pretrained(cache_dir)
+        quantizer.quantize(
+            save_dir=cache_dir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False),
+        )
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True, **_: Any):
+        enc = self.tokenizer(texts, padding=True, truncation=True, max_length=256, return_tensors="np")
+        feeds = {k: v for k, v in enc.items() if k in {i.name for i in self.session.get_inputs()}}
+        hidden = self.session.run(None, feeds)[0]  # (N, T, D) last_hidden_state
+        # mean-pool over non-pad tokens
+        mask = enc["attention_mask"][..., None].astype(np.float32)
+        vecs = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        vecs = vecs.astype(np.float32)
+        if normalize_embeddings:
+            vecs /= np.linalg.norm(vecs, axis=1, keepdims=True) + 1e-12
+        return vecs
+
 
 class DummyEncoder:
     """A tiny deterministic encoder used when sentence-transformers is missing.
@@ -41,29 +101,104 @@ _ENCODER: Any = None
 def get_encoder(model_name: str = "sentence-transformers/all-MiniLM-L6-v2") -> Any:
     global _ENCODER
     if _ENCODER is None:
-        if SentenceTransformer is not None:
-            _ENCODER = SentenceTransformer(model_name)
-        else:
-            _ENCODER = DummyEncoder(dim=64)
+        # Prefer the INT8 ONNX path (3-4x encode throughput on CPU); fall back
+        # to SentenceTransformer, then the dependency-free stub.
+        if os.environ.get("USE_ONNX", "1") != "0":
+            try:
+                cache_dir = os.environ.get(
+                    "ONNX_CACHE_DIR",
+                    os.path.join(os.path.expanduser("~"), ".cache", "misconception_onnx"),
+                )
+                os.makedirs(cache_dir, exist_ok=True)
+                _ENCODER = OnnxEncoder(model_name, cache_dir)
+            except Exception:
+                _ENCODER = None
+        if _ENCODER is None:
+            if SentenceTransformer is not None:
+                _ENCODER = SentenceTransformer(model_name)
+                # On GPU, FP16 halves memory bandwidth and roughly doubles
+                # throughput; cosine drift is well under 1e-3. USE_FP16=0 opts out.
+                try:
+                    if torch is not None and torch.cuda.is_available() and os.environ.get("USE_FP16", "1") != "0":
+                        _ENCODER = _ENCODER.to("cuda").half()
+                    # TorchInductor fuses elementwise ops and trims Python
+                    # dispatch in the forward pass; compilation cost is paid
+                    # once at warm-up (see app startup).
+                    if hasattr(torch, "compile") and os.environ.get("TORCH_COMPILE", "1") != "0":
+                        _ENCODER[0].auto_model = torch.compile(
+                            _ENCODER[0].auto_model, mode="reduce-overhead", fullgraph=False
+                        )
+                except Exception:
+                    pass
+            else:
+                _ENCODER = DummyEncoder(dim=64)
     return _ENCODER
 
 
-def normalize(v: np.ndarray) -> np.ndarray:
-    n = np.linalg.norm(v, axis=1, keepdims=True) + 1e-12
-    return v / n
+def _encode(texts: List[str], encoder: Any) -> np.ndarray:
+    # inference_mode skips autograd bookkeeping (view tracking, version
+    # counters) that SentenceTransformer.encode doesn't disable itself
+    if torch is not None:
+        with torch.inference_mode():
+            return np.asarray(encoder.encode(texts, normalize_embeddings=True), dtype=np.float32)
+    return np.asarray(encoder.encode(texts, normalize_embeddings=True), dtype=np.float32)
 
 
 def embed(texts: List[str], encoder: Any) -> np.ndarray:
-    vecs = encoder.encode(texts, normalize_embeddings=True)
-    return np.asarray(vecs, dtype=np.float32)
+    # Smart batching: the encoder pads every sequence to the longest in the
+    # batch, so for heterogeneous inputs encode in length order and undo the
+    # permutation afterwards. Not worth the bookkeeping for tiny batches.
+    if len(texts) > 4:
+        order = np.argsort([len(t.split()) for t in texts], kind="stable")
+        vecs = _encode([texts[i] for i in order], encoder)
+        inv = np.empty_like(order)
+        inv[order] = np.arange(len(order))
+        return vecs[inv]
+    return _encode(texts, encoder)
+
+
+# ---- embedding cache (content-hash keyed, FIFO eviction) ----
+# Repeat traffic (fixed ideal answers, re-submitted questions) would otherwise
+# re-run the encoder forward pass on identical strings.
+_EMB_CACHE_MAX = 4096
+_emb_cache: dict[bytes, np.ndarray] = {}
+_emb_order: collections.deque = collections.deque()
+
+
+def _emb_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def embed_cached(texts: List[str], encoder: Any) -> np.ndarray:
+    """Like embed() but memoizes per-text vectors; only misses hit the encoder,
+    in a single batched call, and results are spliced back in input order."""
+    keys = [_emb_key(t) for t in texts]
+    out: List[Any] = [_emb_cache.get(k) for k in keys]
+    miss = [i for i, v in enumerate(out) if v is None]
+    if miss:
+        fresh = embed([texts[i] for i in miss], encoder)
+        for row, i in enumerate(miss):
+            vec = fresh[row]
+            out[i] = vec
+            k = keys[i]
+            if k not in _emb_cache:
+                _emb_cache[k] = vec
+                _emb_order.append(k)
+                if len(_emb_order) > _EMB_CACHE_MAX:
+                    _emb_cache.pop(_emb_order.popleft(), None)
+    return np.vstack(out)
 
 
 def cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
-    a = a.reshape(1, -1); b = b.reshape(1, -1)
-    s = float((a @ b.T).squeeze())
-    # already normalized
-    return max(-1.0, min(1.0, s))
+    # vectors are unit-norm (normalize_embeddings=True), so a single dot
+    # product is the cosine similarity -- no reshapes or clamping needed
+    if __debug__:
+        assert abs(float(np.linalg.norm(a)) - 1.0) < 1e-3, "cosine_sim expects unit-norm vectors"
+    return float(a @ b)
+
+
+_WS_RX = re.compile(r"\s+")
 
 
 def clean_text(t: str) -> str:
-    return re.sub(r"\s+", " ", t.strip())
+    return _WS_RX.sub(" ", t.strip())
@@ -0,0 +1,121 @@
+# frontend/streamlit_app.py
+# Lightweight Streamlit UI for the Misconception + IRT backend (see README).
+import os
+import json
+from io import StringIO
+from typing import Any, Dict, Optional
+
+import pandas as pd
+import plotly.express as px
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter, Retry
+
+BACKEND_URL = os.environ.get("BACKEND_URL", "http://127.0.0.1:8000")
+
+# One pooled session for the whole app: keep-alive connections skip the
+# per-click TCP (and TLS) handshake against the backend.
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=20, pool_maxsize=40,
+                       max_retries=Retry(total=2, backoff_factor=0.1))
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+
+
+def request_api(path: str, method: str = "POST", json_body: Optional[Dict[str, Any]] = None,
+                timeout: float = 30.0) -> Dict[str, Any]:
+    url = f"{BACKEND_URL}{path}"
+    r = _SESSION.request(method=method, url=url, json=json_body, timeout=timeout)
+    r.raise_for_status()
+    return r.json()
+
+
+# Figure construction is pure Python and runs on every Streamlit rerun (any
+# widget interaction); cache the figures keyed on the serialized chart data so
+# reruns with unchanged results become dict lookups.
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_pie(pie_json: str):
+    df = pd.read_json(StringIO(pie_json))
+    return px.pie(df, values="value", names="name", hole=0.45,
+                  title="Answer composition")
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_bars(bars_json: str):
+    df = pd.read_json(StringIO(bars_json))
+    return px.bar(df, x="metric", y="value", range_y=[0, 1],
+                  title="Similarity & difficulty")
+
+
+st.set_page_config(page_title="Misconception + IRT", layout="wide")
+st.title("Misconception + IRT Analyzer")
+
+with st.sidebar:
+    st.caption(f"Backend: {BACKEND_URL}")
+    try:
+        health = request_api("/health", method="GET")
+        st.success(f"Backend OK — {health.get('difficulty_items', 0)} IRT items")
+    except Exception as e:
+        st.error(f"Backend unreachable: {e}")
+
+tab_analyze, tab_mis, tab_diff = st.tabs(
+    ["Freeform analysis", "Misconception only", "Difficulty only"])
+
+with tab_analyze:
+    with st.form("analyze_form"):
+        question = st.text_area("Question", "What is a DFA?")
+        ideal = st.text_area("Ideal answer", "A deterministic finite automaton with exactly one transition per state and input symbol.")
+        user = st.text_area("Student answer", "")
+        qid = st.number_input("qid (optional, 0 = none)", min_value=0, value=0, step=1)
+        submitted = st.form_submit_button("Analyze")
+
+    if submitted and user.strip():
+        try:
+            data = request_api("/api/analyze/freeform", json_body={
+                "question_text": question,
+                "ideal_answer_text": ideal,
+                "user_answer_text": user,
+                "qid": int(qid) or None,
+            })
+        except Exception as e:
+            st.error(f"Analysis failed: {e}")
+            data = None
+
+        if data:
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Answer score", data["answer_score"])
+            c2.metric("User vs Ideal", data["similarity"]["user_vs_ideal"])
+            c3.metric("Difficulty", data["difficulty"]["bucket"])
+
+            st.info(data["guidance"])
+            mis = data["misconception"]
+            st.write(f"**Predicted label:** {mis['label']} "
+                     f"(confidence {mis['confidence']}, risk {mis['risk']})")
+
+            pie = data["charts"]["pie"]
+            bars = data["charts"]["bars"]
+            col_pie, col_bar = st.columns(2)
+            with col_pie:
+                st.plotly_chart(build_pie(json.dumps(pie)), use_container_width=True)
+            with col_bar:
+                st.plotly_chart(build_bars(json.dumps(bars)), use_container_width=True)
+
+with tab_mis:
+    ans = st.text_area("Student answer", "", key="mis_answer")
+    mis_qid = st.number_input("qid (optional, 0 = none)", min_value=0, value=0, step=1, key="mis_qid")
+    if st.button("Predict misconception") and ans.strip():
+        try:
+            st.json(request_api("/api/predict_misconception", json_body={
+                "user_answer_text": ans, "qid": int(mis_qid) or None}))
+        except Exception as e:
+            st.error(f"Prediction failed: {e}")
+
+with tab_diff:
+    q = st.text_area("Question", "", key="diff_question")
+    diff_qid = st.number_input("qid (optional, 0 = none)", min_value=0, value=0, step=1, key="diff_qid")
+    if st.button("Estimate difficulty") and q.strip():
+        try:
+            st.json(request_api("/api/estimate_difficulty", json_body={
+                "question_text": q, "qid": int(diff_qid) or None}))
+        except Exception as e:
+            st.error(f"Difficulty estimation failed: {e}")